@@ -3,12 +3,26 @@
 import collections
 import enum
 import math
+import multiprocessing
+import multiprocessing.synchronize
 import os
 import pathlib
-from typing import List, Final, Mapping, Callable, MutableMapping, Tuple, Any
+import queue
+from typing import (
+    List,
+    Final,
+    Mapping,
+    Callable,
+    MutableMapping,
+    Tuple,
+    Any,
+    Optional,
+    Set,
+)
 
 import cv2
 import numpy as np
+import numpy.typing as npt
 import tensorflow as tf
 import tensorflow_hub as hub
 from icontract import require
@@ -137,17 +151,273 @@ def _load_tf_model(path: pathlib.Path) -> Any:
 Detector = Callable[[cv2.Mat], List[Detection]]
 
 
+class Precision(enum.Enum):
+    """Represent the numerical precision of the model weights."""
+
+    #: Original model as-is
+    FP32 = "fp32"
+
+    #: Weights converted to half-precision floats
+    FP16 = "fp16"
+
+    #: Weights quantized to 8-bit integers
+    INT8 = "int8"
+
+
+def count_available_cores() -> int:
+    """
+    Count the cores available to this process.
+
+    If the process has been pinned to particular cores, only these are counted.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+#: Directory where the models converted to TF Lite are cached
+TFLITE_CACHE_DIR = pathlib.Path.home() / ".cache" / "el-volante-virtual"
+
+
+# noinspection SpellCheckingInspection
+def _convert_to_tflite(path: pathlib.Path, precision: Precision) -> bytes:
+    """
+    Convert the model to TF Lite with the reduced precision.
+
+    :param path: to the model directory
+    :param precision: of the converted model
+    :return: serialized TF Lite model
+    """
+    converter = tf.lite.TFLiteConverter.from_saved_model(str(path))
+
+    # NOTE (mristin, 2023-08-27):
+    # Without a representative dataset, the default optimization quantizes
+    # the weights to 8-bit integers, while the activations are quantized dynamically.
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if precision is Precision.FP16:
+        converter.target_spec.supported_types = [tf.float16]
+
+    result = converter.convert()
+    assert isinstance(result, bytes)
+    return result
+
+
+def _load_tflite_interpreter(path: pathlib.Path, precision: Precision) -> Any:
+    """
+    Load the model converted to TF Lite, and convert it first if necessary.
+
+    The conversion takes a while, so we cache the converted model in
+    :py:data:`TFLITE_CACHE_DIR`. This way we do not have to distribute multiple
+    versions of the model. If the cached model can not be loaded, we convert
+    the model again and overwrite the cache. If the cache can not be written,
+    we use the converted model from memory.
+
+    :param path: to the model directory
+    :param precision: of the converted model
+    :return: TF Lite interpreter
+    """
+    # NOTE (mristin, 2023-08-30):
+    # The converted model depends on the version of the converter, so we
+    # include the version of TensorFlow in the file name. This way an upgrade
+    # of TensorFlow never picks up a model converted by an older version.
+    cache_path = (
+        TFLITE_CACHE_DIR / f"{path.name}.{precision.value}.tf-{tf.__version__}.tflite"
+    )
+
+    if cache_path.exists():
+        try:
+            return tf.lite.Interpreter(
+                model_path=str(cache_path), num_threads=count_available_cores()
+            )
+        except (ValueError, RuntimeError):
+            # NOTE (mristin, 2023-08-30):
+            # The cached model is corrupt, for example, due to a full disk,
+            # so we simply convert it again.
+            pass
+
+    model_content = _convert_to_tflite(path, precision)
+
+    # NOTE (mristin, 2023-08-29):
+    # We write to a temporary file first so that a concurrently running
+    # instance never sees a partially written model.
+    tmp_path = cache_path.parent / f"{cache_path.name}.{os.getpid()}.tmp"
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(model_content)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    return tf.lite.Interpreter(
+        model_content=model_content, num_threads=count_available_cores()
+    )
+
+
+def _load_tflite_inference(
+    path: pathlib.Path, precision: Precision
+) -> Callable[[Any], Any]:
+    """
+    Load the model converted to TF Lite with the reduced precision.
+
+    :param path: to the model directory
+    :param precision: of the converted model
+    :return: function mapping the input tensor to the output array
+    """
+    interpreter = _load_tflite_interpreter(path, precision)
+
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+
+    # NOTE (mristin, 2023-08-27):
+    # The model accepts inputs of variable size, so we need to re-allocate
+    # the tensors whenever the size of the input changes.
+    allocated_shape = None  # type: Optional[Tuple[int, ...]]
+
+    def infer(tf_input_img: Any) -> Any:
+        nonlocal allocated_shape
+
+        input_img = tf_input_img.numpy()
+
+        if input_img.shape != allocated_shape:
+            interpreter.resize_tensor_input(input_index, input_img.shape)
+            interpreter.allocate_tensors()
+            allocated_shape = input_img.shape
+
+        interpreter.set_tensor(input_index, input_img)
+        interpreter.invoke()
+
+        return interpreter.get_tensor(output_index)
+
+    return infer
+
+
+def _configure_tf_threads() -> None:
+    """
+    Configure the thread pools of TensorFlow for the inference on CPU.
+
+    The pools can be configured only before TensorFlow initializes its runtime.
+    If the runtime has been already initialized, we leave the pools as they are.
+    """
+    # NOTE (mristin, 2023-08-29):
+    # We run a single model at a time, so we let a single operation spread over
+    # all the cores, while a couple of independent operations can run in parallel.
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(count_available_cores())
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+    except RuntimeError:
+        pass
+
+
+def _load_inference(path: pathlib.Path, precision: Precision) -> Callable[[Any], Any]:
+    """
+    Load the model and return the function mapping the input tensor to the output.
+
+    :param path: to the model directory
+    :param precision: of the model
+    :return: inference function
+    """
+    if precision is Precision.FP32:
+        _configure_tf_threads()
+
+        model = _load_tf_model(path)
+
+        movenet = model.signatures["serving_default"]
+
+        def infer(tf_input_img: Any) -> Any:
+            return movenet(tf_input_img)["output_0"]
+
+        return infer
+
+    return _load_tflite_inference(path, precision)
+
+
+#: Size of the larger side of the input to the model
+MODEL_INPUT_SIZE = 256
+
+
+def determine_input_size(height: int, width: int) -> Tuple[int, int]:
+    """
+    Determine the size of the model input for an image of the given size.
+
+    Both height and width need to be multiple of 32, height to width ratio should
+    resemble the original image, and the larger side should be made to
+    :py:data:`MODEL_INPUT_SIZE` pixels.
+
+    >>> determine_input_size(720, 1280)
+    (128, 256)
+
+    >>> determine_input_size(640, 480)
+    (256, 192)
+
+    :param height: of the original image
+    :param width: of the original image
+    :return: height and width of the model input
+    """
+    if height > width:
+        new_height = MODEL_INPUT_SIZE
+        # fmt: off
+        new_width = int(
+            (float(width) * float(new_height) / float(height)) // 32
+        ) * 32
+        # fmt: on
+    else:
+        new_width = MODEL_INPUT_SIZE
+        # fmt: off
+        new_height = int(
+            (float(height) * float(new_width) / float(width)) // 32
+        ) * 32
+        # fmt: on
+
+    return new_height, new_width
+
+
+def downscale_for_detection(img: cv2.Mat, out: Optional[cv2.Mat] = None) -> cv2.Mat:
+    """
+    Downscale the image to the size of the model input.
+
+    The keypoints are given in relative coordinates, so you can apply the detector
+    on the downscaled image and use the detections on the original one.
+
+    :param img: to be downscaled
+    :param out:
+        scratch buffer to downscale into, if it has the right shape, so that
+        we do not allocate a new image on every frame
+    :return: downscaled image
+    """
+    height, width, _ = img.shape
+
+    new_height, new_width = determine_input_size(height, width)
+
+    if new_height == height and new_width == width:
+        return img
+
+    if out is not None and out.shape == (new_height, new_width, img.shape[2]):
+        return cv2.resize(
+            img, (new_width, new_height), dst=out, interpolation=cv2.INTER_AREA
+        )
+
+    return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+
 @require(lambda path: path.exists() and path.is_dir())
-def load_detector(path: pathlib.Path) -> Detector:
+def load_detector(
+    path: pathlib.Path, precision: Precision = Precision.FP32
+) -> Detector:
     """
     Load the model and return the function which you can readily use on images.
 
     :param path: to the model directory
+    :param precision:
+        of the model; reduced precision makes the detection faster on CPU, but
+        less accurate
     :return: detector function to be applied on images
     """
-    model = _load_tf_model(path)
-
-    movenet = model.signatures["serving_default"]
+    infer = _load_inference(path, precision)
 
     # If a detection has a score below this threshold, it will be ignored.
     detection_score_threshold = 0.2
@@ -163,48 +433,33 @@ def load_detector(path: pathlib.Path) -> Detector:
         # * https://analyticsindiamag.com/how-to-do-pose-estimation-with-movenet/ and
         # * https://github.com/geaxgx/openvino_movenet_multipose/blob/main/MovenetMPOpenvino.py
 
-        # Both height and width need to be multiple of 32,
-        # height to width ratio should resemble the original image, and
-        # the larger side should be made to 256 pixels.
-        #
-        # Example: 720x1280 should be resized to 160x256.
+        # NOTE (mristin, 2023-08-26):
+        # The callers usually downscale the image already with
+        # :py:func:`downscale_for_detection` so that the resizing here is a no-op.
 
-        height, width, _ = img.shape
+        # NOTE (mristin, 2023-08-28):
+        # MoveNet MultiPose detects all the persons in a single pass over the whole
+        # image. Hence, both players are already processed in one batch, and there
+        # are no per-player crops which we could stack into a larger batch.
 
-        input_size = 256
+        height, width, _ = img.shape
 
-        if height > width:
-            new_height = input_size
-            # fmt: off
-            new_width = int(
-                (float(width) * float(new_height) / float(height)) // 32
-            ) * 32
-            # fmt: on
-        else:
-            new_width = input_size
-            # fmt: off
-            new_height = int(
-                (float(height) * float(new_width) / float(width)) // 32
-            ) * 32
-            # fmt: on
+        new_height, new_width = determine_input_size(height, width)
 
         if new_height != height or new_width != width:
-            resized = cv2.resize(img, (new_width, new_height))
+            resized = cv2.resize(
+                img, (new_width, new_height), interpolation=cv2.INTER_AREA
+            )
         else:
             resized = img
 
-        tf_input_img = tf.cast(
-            tf.image.resize_with_pad(
-                image=tf.expand_dims(resized, axis=0),
-                target_height=new_height,
-                target_width=new_width,
-            ),
-            dtype=tf.int32,
-        )
+        # NOTE (mristin, 2023-08-29):
+        # The image has already the size of the model input, so we do not pad it.
+        # Padding would merely copy the image into a new float tensor.
+        tf_input_img = tf.cast(tf.expand_dims(resized, axis=0), dtype=tf.int32)
 
-        inference = movenet(tf_input_img)
-        output_as_tensor = inference["output_0"]
-        assert output_as_tensor.shape == (1, 6, 56)
+        output_as_tensor = infer(tf_input_img)
+        assert tuple(output_as_tensor.shape) == (1, 6, 56)
 
         output = np.squeeze(output_as_tensor)
         assert output.shape == (6, 56)
@@ -252,6 +507,250 @@ def load_detector(path: pathlib.Path) -> Detector:
     return apply_model
 
 
+#: Size of the thumbnail used to detect the motion between the frames
+MOTION_THUMBNAIL_SIZE = 64
+
+#: Size of the square blocks of the thumbnail, in thumbnail pixels, which we compare
+#: between the frames. At the capture resolution, a block roughly covers a hand.
+MOTION_BLOCK_SIZE = 8
+
+#: Mean absolute difference of a block of the grayscale thumbnails, in intensity
+#: levels, below which we consider the block as static
+MOTION_THRESHOLD = 2.0
+
+
+@require(lambda threshold: threshold >= 0.0)
+def gate_by_motion(detector: Detector, threshold: float = MOTION_THRESHOLD) -> Detector:
+    """
+    Wrap the detector so that it is skipped on the frames without motion.
+
+    If no block of the frame changed enough, we re-use the previous detections.
+
+    :param detector: to be wrapped
+    :param threshold:
+        mean absolute difference of a block of the grayscale thumbnails,
+        in intensity levels, below which the block is considered static
+    :return: gated detector
+    """
+    # NOTE (mristin, 2023-08-28):
+    # We compare against the thumbnail of the last *detected* frame instead of
+    # the previous frame. Otherwise, a slow movement would never exceed
+    # the threshold, and the detections would get stuck.
+    #
+    # NOTE (mristin, 2023-08-30):
+    # We take the maximum over the blocks instead of the mean over the whole
+    # thumbnail. The hands cover only a small part of the frame, so the mean
+    # dilutes their movement, and a slow turn of the wheel would be missed.
+    #
+    # We picked the threshold on synthetic frames of 640 x 480 pixels with
+    # the sensor noise of a typical webcam (standard deviation of 3 intensity
+    # levels). The noise alone gives about 0.6 levels, while the wrists moving by
+    # 2 pixels already give about 2.5 levels. The mean over the whole thumbnail
+    # stayed below 1 level even when the wrists moved by 10 pixels. Re-check
+    # the threshold on a recorded video if you change the thumbnail or the block
+    # size.
+    reference = None  # type: Optional[npt.NDArray[np.float32]]
+    last_detections = []  # type: List[Detection]
+
+    blocks = MOTION_THUMBNAIL_SIZE // MOTION_BLOCK_SIZE
+
+    def apply_gated(img: cv2.Mat) -> List[Detection]:
+        nonlocal reference, last_detections
+
+        thumbnail = cv2.resize(
+            cv2.cvtColor(img, cv2.COLOR_BGR2GRAY),
+            (MOTION_THUMBNAIL_SIZE, MOTION_THUMBNAIL_SIZE),
+            interpolation=cv2.INTER_AREA,
+        ).astype(np.float32)
+
+        if reference is not None:
+            block_differences = (
+                np.abs(thumbnail - reference)
+                .reshape(blocks, MOTION_BLOCK_SIZE, blocks, MOTION_BLOCK_SIZE)
+                .mean(axis=(1, 3))
+            )
+
+            if float(np.max(block_differences)) < threshold:
+                return last_detections
+
+        reference = thumbnail
+        last_detections = detector(img)
+
+        return last_detections
+
+    return apply_gated
+
+
+def warm_up(detector: Detector) -> None:
+    """
+    Run the detector once on a blank image.
+
+    The first inference is much slower than the following ones, since the framework
+    initializes its kernels and allocates its buffers lazily. We assume the input
+    of a landscape 4:3 webcam, the most common aspect ratio.
+    """
+    height, width = determine_input_size(MODEL_INPUT_SIZE * 3 // 4, MODEL_INPUT_SIZE)
+    detector(np.zeros((height, width, 3), dtype=np.uint8))
+
+
+def _put_dropping_stale(target: "multiprocessing.Queue[Any]", item: Any) -> None:
+    """Put the item in the queue, and drop the oldest items if the queue is full."""
+    while True:
+        try:
+            target.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                target.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _detect_in_loop(
+    path: pathlib.Path,
+    precision: Precision,
+    input_queue: "multiprocessing.Queue[Any]",
+    output_queue: "multiprocessing.Queue[Any]",
+    ready: "multiprocessing.synchronize.Event",
+    cores: Optional[Set[int]],
+    skip_static_frames: bool,
+) -> None:
+    """Apply the detector on the frames until ``None`` is received."""
+    if cores is not None:
+        # NOTE (mristin, 2023-08-30):
+        # We pin the process before loading the model so that the thread pools of
+        # TensorFlow and OpenCV are sized to, and inherit, the given cores.
+        os.sched_setaffinity(0, cores)
+        cv2.setNumThreads(len(cores))
+
+    detector = load_detector(path, precision)
+    warm_up(detector)
+
+    if skip_static_frames:
+        detector = gate_by_motion(detector)
+
+    ready.set()
+
+    while True:
+        item = input_queue.get()
+        if item is None:
+            break
+
+        frame_id, frame = item
+
+        detections = detector(frame)
+
+        _put_dropping_stale(output_queue, (frame_id, detections))
+
+
+class DetectorProcess:
+    """
+    Run the detector in a separate process.
+
+    The detector is the most expensive part of the pipeline. We run it in a separate
+    process so that the drawing and the keyboard handling can overlap with
+    the detection on the next frame.
+
+    Since the detection runs in its own interpreter, it never competes for the global
+    interpreter lock with the capture and the drawing threads, regardless of whether
+    the inference back-end releases the lock.
+
+    If the detector can not keep up, the stale frames are dropped and only the latest
+    frames are processed. Hence, we identify each frame so that the caller can match
+    the detections with the frames.
+    """
+
+    @require(lambda path: path.exists() and path.is_dir())
+    @require(lambda cores: cores is None or len(cores) > 0)
+    @require(
+        lambda cores: cores is None or hasattr(os, "sched_setaffinity"),
+        "Pinning to the cores is supported only on some platforms such as Linux",
+    )
+    def __init__(
+        self,
+        path: pathlib.Path,
+        precision: Precision = Precision.FP32,
+        cores: Optional[Set[int]] = None,
+        skip_static_frames: bool = False,
+    ) -> None:
+        """
+        Start the process and load the model in it.
+
+        :param path: to the model directory
+        :param precision: of the model
+        :param cores:
+            if given, the process is pinned to these cores so that it does not
+            compete with the other threads of the application
+        :param skip_static_frames:
+            if set, re-use the previous detections on the frames without motion,
+            see :py:func:`gate_by_motion`
+        """
+        self._input_queue = multiprocessing.Queue(
+            maxsize=2
+        )  # type: multiprocessing.Queue[Any]
+
+        self._output_queue = multiprocessing.Queue(
+            maxsize=2
+        )  # type: multiprocessing.Queue[Any]
+
+        self._ready = multiprocessing.Event()
+
+        self._process = multiprocessing.Process(
+            target=_detect_in_loop,
+            args=(
+                path,
+                precision,
+                self._input_queue,
+                self._output_queue,
+                self._ready,
+                cores,
+                skip_static_frames,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+
+    def wait_until_ready(self) -> None:
+        """Wait until the model has been loaded and warmed up."""
+        while not self._ready.wait(timeout=1.0):
+            if not self._process.is_alive():
+                raise RuntimeError(
+                    f"The detector process died while loading the model "
+                    f"with the exit code {self._process.exitcode}"
+                )
+
+    def submit(self, frame_id: int, frame: cv2.Mat) -> None:
+        """
+        Queue the frame for the detection, dropping the stale frames if needed.
+
+        You should downscale the frame with :py:func:`downscale_for_detection`
+        beforehand so that we do not pass around the full-resolution frames between
+        the processes.
+        """
+        _put_dropping_stale(self._input_queue, (frame_id, frame))
+
+    def fetch(self) -> Tuple[int, List[Detection]]:
+        """Wait for the detections of the next processed frame given by its ID."""
+        while True:
+            try:
+                frame_id, detections = self._output_queue.get(timeout=1.0)
+                return frame_id, detections
+            except queue.Empty as exception:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        f"The detector process died unexpectedly "
+                        f"with the exit code {self._process.exitcode}"
+                    ) from exception
+
+    def close(self) -> None:
+        """Signal the process to stop and wait for it."""
+        _put_dropping_stale(self._input_queue, None)
+
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
 @require(
     lambda hip, knee, ankle: hip[1] > ankle[1] and knee[1] > ankle[1],
     "Coordinate origin in the bottom-left of the image, not in the top-left",
@@ -0,0 +1,201 @@
+"""Capture the frames from the camera in the background."""
+
+import threading
+import time
+from typing import Optional, Tuple
+
+import cv2
+
+#: Width of the frames requested from the camera
+CAPTURE_WIDTH = 640
+
+#: Height of the frames requested from the camera
+CAPTURE_HEIGHT = 480
+
+#: Frame rate requested from the camera
+CAPTURE_FPS = 30
+
+
+def gstreamer_pipeline(camera_index: int) -> str:
+    """
+    Build the GStreamer pipeline reading from the V4L2 camera at ``camera_index``.
+
+    The sink keeps only the latest buffer so that the stale frames are dropped
+    already at the source.
+
+    >>> gstreamer_pipeline(2).split(" ! ")[0]
+    'v4l2src device=/dev/video2'
+    """
+    return (
+        f"v4l2src device=/dev/video{camera_index} "
+        f"! video/x-raw,width={CAPTURE_WIDTH},height={CAPTURE_HEIGHT},"
+        f"framerate={CAPTURE_FPS}/1 "
+        "! videoconvert "
+        "! video/x-raw,format=BGR "
+        "! appsink drop=1 max-buffers=1"
+    )
+
+
+def open_video_capture(camera_index: int, use_gstreamer: bool) -> cv2.VideoCapture:
+    """
+    Open the video capture for the camera.
+
+    :param camera_index: index of the camera as expected by OpenCV
+    :param use_gstreamer:
+        if set, read the camera through a GStreamer pipeline instead of the default
+        back-end
+    :return: opened video capture
+    :raise: :py:class:`RuntimeError` if the GStreamer pipeline could not be opened
+    """
+    if not use_gstreamer:
+        cap = cv2.VideoCapture(camera_index)
+
+        # NOTE (mristin, 2023-08-29):
+        # The back-ends buffer multiple frames by default, so that we would read
+        # the frames which are already stale. Not all the back-ends support this
+        # property, in which case the setting is simply ignored.
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        # NOTE (mristin, 2023-08-29):
+        # Most webcams default to uncompressed YUYV which is both limited by
+        # the USB bandwidth and expensive to convert. We request MJPEG at
+        # a resolution sufficient for the detector. The format has to be set
+        # before the resolution, since some drivers reset the resolution otherwise.
+        # The camera is free to pick the closest mode it supports.
+        # noinspection PyUnresolvedReferences
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+        cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
+
+        return cap
+
+    cap = cv2.VideoCapture(gstreamer_pipeline(camera_index), cv2.CAP_GSTREAMER)
+    if not cap.isOpened():
+        raise RuntimeError(
+            "The GStreamer pipeline could not be opened; "
+            "is OpenCV built with the GStreamer support?"
+        )
+
+    return cap
+
+
+#: Grabbing faster than this duration, in seconds, means that the frame has been
+#: already waiting in the buffer of the back-end
+_BUFFERED_GRAB_DURATION = 0.005
+
+#: Maximum number of buffered frames skipped before we retrieve a frame
+_MAX_SKIPPED_FRAMES = 4
+
+
+class FrameGrabber:
+    """
+    Read the frames from the camera in a separate thread.
+
+    We keep only the latest frame. Stale frames are simply overwritten so that
+    the consumer always processes the freshest frame, and the camera can already
+    capture the next frame while the consumer is still busy with the current one.
+    """
+
+    # NOTE (mristin, 2023-08-21):
+    # The reading from the camera blocks until the next frame arrives. If we read
+    # the frames synchronously, the detector waits on the camera on every frame.
+
+    def __init__(self, camera_index: int, use_gstreamer: bool = False) -> None:
+        """
+        Open the video capture and start reading the frames.
+
+        :param camera_index: index of the camera as expected by OpenCV
+        :param use_gstreamer: if set, read the camera through a GStreamer pipeline
+        """
+        self._cap = open_video_capture(camera_index, use_gstreamer)
+
+        self._condition = threading.Condition()
+
+        # NOTE (mristin, 2023-08-21):
+        # The following properties are guarded by ``self._condition``.
+        self._latest = None  # type: Optional[cv2.Mat]
+        self._fresh = False
+        self._reading_ok = True
+
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _grab_latest(self) -> bool:
+        """
+        Grab the next frame, and skip the frames stale in the buffer of the back-end.
+
+        Some back-ends ignore the requested buffer size. If we fall behind, we would
+        then consume the stale frames one by one, and lag more and more. We skip
+        the frames which are delivered immediately, as they have been waiting in
+        the buffer, so that we do not decode them in vain.
+
+        :return: False if the grabbing failed
+        """
+        for _ in range(_MAX_SKIPPED_FRAMES + 1):
+            start = time.monotonic()
+
+            if not self._cap.grab():
+                return False
+
+            if time.monotonic() - start >= _BUFFERED_GRAB_DURATION:
+                break
+
+        return True
+
+    def _loop(self) -> None:
+        """Read the frames until stopped or until the capture fails."""
+        while not self._stop.is_set():
+            # NOTE (mristin, 2023-08-29):
+            # We grab outside of the lock, since grabbing blocks until the camera
+            # delivers the next frame.
+            if not self._grab_latest():
+                with self._condition:
+                    self._reading_ok = False
+                    self._latest = None
+                    self._fresh = False
+                    self._condition.notify_all()
+                break
+
+            # NOTE (mristin, 2023-08-29):
+            # If the latest frame has not been handed out to the consumer, it is
+            # stale now, and nobody else refers to it. We take it over, and retrieve
+            # the new frame into its memory to avoid allocating a new frame.
+            with self._condition:
+                buffer = self._latest if self._fresh else None
+                self._latest = None
+                self._fresh = False
+
+            reading_ok, frame = self._cap.retrieve(buffer)
+
+            with self._condition:
+                self._reading_ok = reading_ok
+                self._latest = frame if reading_ok else None
+                self._fresh = reading_ok
+                self._condition.notify_all()
+
+            if not reading_ok:
+                break
+
+    def read(self) -> Tuple[bool, Optional[cv2.Mat]]:
+        """
+        Wait for a frame which has not been read before.
+
+        Return ``(False, None)`` if the capture failed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._fresh or not self._reading_ok)
+
+            if not self._reading_ok:
+                return False, None
+
+            self._fresh = False
+            return True, self._latest
+
+    def release(self) -> None:
+        """Stop reading the frames and release the video capture."""
+        self._stop.set()
+        self._thread.join()
+        self._cap.release()
@@ -0,0 +1,23 @@
+"""Translate the names of the keys to the keys of :py:mod:`pynput`."""
+
+import functools
+from typing import Union
+
+import pynput.keyboard
+
+#: Map names of the special keys, such as ``ctrl`` or ``up``, to the keys
+KEY_BY_NAME = {key.name: key for key in pynput.keyboard.Key}
+
+
+@functools.lru_cache(maxsize=256)
+def key_from_string(key: str) -> Union[pynput.keyboard.Key | pynput.keyboard.KeyCode]:
+    """
+    Translate the string into a key.
+
+    We cache the translations so that we do not create a new key object on every
+    press or release.
+    """
+    if len(key) == 1:
+        return pynput.keyboard.KeyCode.from_char(key)
+
+    return KEY_BY_NAME[key]
@@ -1,31 +1,40 @@
 """Be a racing gamepad with the webcam and your arms."""
 
 import argparse
-import collections
+import concurrent.futures
 import enum
+import functools
 import importlib
+import itertools
 import math
+import multiprocessing
 import os
 import pathlib
 import sys
 from typing import (
+    Final,
     Optional,
     Tuple,
     Sequence,
-    MutableMapping,
+    Dict,
     Set,
     Mapping,
     Protocol,
     List,
     Union,
+    Iterable,
 )
 
 import cv2
+import numpy as np
+import numpy.typing as npt
 import pynput.keyboard
 from icontract import ensure, require
 
 import elvolantevirtual
 from elvolantevirtual import bodypose
+from elvolantevirtual import capture
+from elvolantevirtual.keys import KEY_BY_NAME, key_from_string
 
 assert elvolantevirtual.__doc__ == __doc__
 
@@ -73,15 +82,53 @@ class PointXY:
         self.y = y
 
 
+_NOSE = bodypose.KeypointLabel.NOSE
+_LEFT_WRIST = bodypose.KeypointLabel.LEFT_WRIST
+_RIGHT_WRIST = bodypose.KeypointLabel.RIGHT_WRIST
+_LEFT_SHOULDER = bodypose.KeypointLabel.LEFT_SHOULDER
+_RIGHT_SHOULDER = bodypose.KeypointLabel.RIGHT_SHOULDER
+_LEFT_HIP = bodypose.KeypointLabel.LEFT_HIP
+_RIGHT_HIP = bodypose.KeypointLabel.RIGHT_HIP
+
+
+class DetectionView:
+    """
+    Provide a direct access to the keypoints of a detection relevant for the game.
+
+    The view is built once per detection and frame so that the downstream functions
+    do not need to look up the keypoints over and over again.
+    """
+
+    nose: Final[Optional[bodypose.Keypoint]]
+    left_wrist: Final[Optional[bodypose.Keypoint]]
+    right_wrist: Final[Optional[bodypose.Keypoint]]
+    left_shoulder: Final[Optional[bodypose.Keypoint]]
+    right_shoulder: Final[Optional[bodypose.Keypoint]]
+    left_hip: Final[Optional[bodypose.Keypoint]]
+    right_hip: Final[Optional[bodypose.Keypoint]]
+
+    def __init__(self, detection: bodypose.Detection) -> None:
+        """Look up the keypoints of the ``detection``."""
+        keypoints = detection.keypoints
+
+        self.nose = keypoints.get(_NOSE, None)
+        self.left_wrist = keypoints.get(_LEFT_WRIST, None)
+        self.right_wrist = keypoints.get(_RIGHT_WRIST, None)
+        self.left_shoulder = keypoints.get(_LEFT_SHOULDER, None)
+        self.right_shoulder = keypoints.get(_RIGHT_SHOULDER, None)
+        self.left_hip = keypoints.get(_LEFT_HIP, None)
+        self.right_hip = keypoints.get(_RIGHT_HIP, None)
+
+
 @ensure(
     lambda result: not (result is not None)
     or (result == 0 or result == 1)  # pylint: disable=consider-using-in
 )
 def determine_player_id_of_the_detection(
-    detection: bodypose.Detection,
+    view: DetectionView,
 ) -> Optional[int]:
     """Determine the corresponding player ID of the detection based on its position."""
-    center = determine_center_of_wrists(detection)
+    center = determine_center_of_wrists(view)
     if center is None:
         return None
 
@@ -91,60 +138,32 @@ def determine_player_id_of_the_detection(
 
 
 def split_detections_for_each_player(
-    detections: Sequence[bodypose.Detection],
-) -> Tuple[Optional[bodypose.Detection], Optional[bodypose.Detection]]:
+    views: Sequence[DetectionView],
+) -> Tuple[Optional[DetectionView], Optional[DetectionView]]:
     """Determine which detection belongs to which player."""
-    detection_by_player = [
+    view_by_player = [
         None,
         None,
-    ]  # type: List[Optional[bodypose.Detection]]
+    ]  # type: List[Optional[DetectionView]]
 
-    for detection in detections:
-        player_id = determine_player_id_of_the_detection(detection)
+    for view in views:
+        player_id = determine_player_id_of_the_detection(view)
         if player_id is None:
             continue
 
-        if detection_by_player[player_id] is None:
-            detection_by_player[player_id] = detection
+        if view_by_player[player_id] is None:
+            view_by_player[player_id] = view
         else:
             # NOTE (mristin, 2023-07-26):
             # We simply pick the first detection that corresponds to the player's
             # quadrant. This is an arbitrary heuristic, but works well in practice.
             pass
 
-    return detection_by_player[0], detection_by_player[1]
-
-
-def determine_hip_level(detection: bodypose.Detection) -> Optional[float]:
-    """
-    Try to determine the average hip y level.
-
-    If neither of the hip keypoints is available, return ``None``.
-    """
-    left_hip = detection.keypoints.get(bodypose.KeypointLabel.LEFT_HIP, None)
-    right_hip = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_HIP, None)
-
-    if left_hip is None and right_hip is None:
-        return None
-
-    hip_avg_y = 0.0
-    hip_point_count = 0.0
-
-    if left_hip is not None:
-        hip_avg_y += left_hip.y
-        hip_point_count += 1
-
-    if right_hip is not None:
-        hip_avg_y += right_hip.y
-        hip_point_count += 1
-
-    hip_avg_y /= hip_point_count
-
-    return hip_avg_y
+    return view_by_player[0], view_by_player[1]
 
 
 def determine_center_of_wrists(
-    detection: bodypose.Detection,
+    view: DetectionView,
 ) -> Optional[Tuple[float, float]]:
     """
     Try to detect the center between the hands.
@@ -155,8 +174,8 @@ def determine_center_of_wrists(
 
     Return ``None`` if either of the hands could not be detected.
     """
-    left_wrist = detection.keypoints.get(bodypose.KeypointLabel.LEFT_WRIST, None)
-    right_wrist = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_WRIST, None)
+    left_wrist = view.left_wrist
+    right_wrist = view.right_wrist
 
     if left_wrist is None or right_wrist is None:
         return None
@@ -176,142 +195,188 @@ def determine_center_of_wrists(
     return center_x, center_y
 
 
-def determine_pointer_position(detection: bodypose.Detection) -> Pointer:
+def determine_pointer_position(view: DetectionView) -> Pointer:
     """
     Determine the pointer level based on the given body pose detection of the player.
 
     If the essential keypoints are not detected, we return
     :py:attr:`Pointer.NOT_DETECTED`.
     """
-    nose = detection.keypoints.get(bodypose.KeypointLabel.NOSE, None)
-    if nose is None:
-        return Pointer.NOT_DETECTED
+    return compute_player_features([view])[0].pointer
 
-    top = nose.y
 
-    bottom = determine_hip_level(detection)
-    if bottom is None:
-        return Pointer.NOT_DETECTED
+#: In degrees
+ANGLE_TOLERANCE_FOR_NEUTRALITY = 22
 
-    center = determine_center_of_wrists(detection)
-    if center is None:
-        return Pointer.NOT_DETECTED
 
-    pointer = center[1]
+def determine_wheel_direction(view: DetectionView) -> Wheel:
+    """
+    Determine the wheel direction based on the given hand pose of the player.
 
-    # NOTE (mristin, 2023-07-26):
-    # The coordinates of the body keypoints live in the top-left corner of the input
-    # frame. The higher pointer in the physical space is *lower* in that space.
+    If the hands are not detected, we return :py:attr:`Wheel.NOT_DETECTED`.
+    """
+    return compute_player_features([view])[0].wheel
 
-    relative_pointer = (bottom - pointer) / (bottom - top)
 
-    if relative_pointer > 0.66:
-        return Pointer.HIGH
-    elif relative_pointer > 0.33:
-        return Pointer.MID
-    else:
-        return Pointer.LOW
+#: Keypoints relevant for the pointer and the wheel in the order of
+#: :py:func:`pack_keypoints`
+KEYPOINTS_OF_INTEREST = (_NOSE, _LEFT_WRIST, _RIGHT_WRIST, _LEFT_HIP, _RIGHT_HIP)
 
 
-def determine_wheel_angle(detection: bodypose.Detection) -> Optional[float]:
+def pack_keypoints(
+    views: Sequence[Optional[DetectionView]],
+) -> npt.NDArray[np.float64]:
     """
-    Calculate the angle of the wheel for the given detection.
+    Pack the keypoints of interest of all the detections in a single array.
 
-    If no essential keypoints are detected, return None.
+    The result is of shape ``(len(views), len(KEYPOINTS_OF_INTEREST), 2)``
+    holding x and y coordinates. Missing keypoints and missing detections are
+    represented as NaN.
     """
-    left_wrist = detection.keypoints.get(bodypose.KeypointLabel.LEFT_WRIST, None)
-    right_wrist = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_WRIST, None)
+    result = np.full((len(views), len(KEYPOINTS_OF_INTEREST), 2), np.nan)
 
-    if left_wrist is None or right_wrist is None:
-        return None
+    for view_i, view in enumerate(views):
+        if view is None:
+            continue
 
-    xmin = min(left_wrist.x, right_wrist.x)
-    xmax = max(left_wrist.x, right_wrist.x)
+        for keypoint_i, keypoint in enumerate(
+            (
+                view.nose,
+                view.left_wrist,
+                view.right_wrist,
+                view.left_hip,
+                view.right_hip,
+            )
+        ):
+            if keypoint is not None:
+                result[view_i, keypoint_i, 0] = keypoint.x
+                result[view_i, keypoint_i, 1] = keypoint.y
 
-    ymin = min(left_wrist.y, right_wrist.y)
-    ymax = max(left_wrist.y, right_wrist.y)
+    return result
 
-    # NOTE (mristin, 2023-08-16):
-    # Center point between the two hands is given here in the coordinate system whose
-    # origin is placed in the top-left corner of the screen.
-    center_x = xmin + (xmax - xmin) / 2.0
-    center_y = ymin + (ymax - ymin) / 2.0
 
-    # NOTE (mristin, 2023-08-16):
-    # We focus only on the right hand as we assume that the wheel is formed by putting
-    # a circle through *both* hands.
+#: Map codes of :py:func:`classify_keypoints` to the pointer levels
+POINTER_BY_CODE = (Pointer.NOT_DETECTED, Pointer.LOW, Pointer.MID, Pointer.HIGH)
 
-    # NOTE (mristin, 2023-08-17):
-    # We flip the input to give better feedback to the user. However, this means
-    # that the detector sees flipped keypoints as well. Therefore, the right hand
-    # corresponds then to the *left* wrist keypoint.
+#: Map codes of :py:func:`classify_keypoints` to the wheel directions
+WHEEL_BY_CODE = (Wheel.NOT_DETECTED, Wheel.RIGHT, Wheel.NEUTRAL, Wheel.LEFT)
 
-    # NOTE (mristin, 2023-08-16):
-    # Vector lives here in the coordinate system whose origin is placed in the top-left
-    # corner of the screen.
-    vector_x = left_wrist.x - center_x
-    vector_y = left_wrist.y - center_y
+#: Thresholds on the relative pointer between the low, middle and high level
+POINTER_THRESHOLDS = np.array([0.33, 0.66])
 
-    # NOTE (mristin, 2023-08-16):
-    # We have to take ``-vector_y`` since the coordinates originate from the top-left
-    # corner of the screen.
-    angle_in_radians = math.atan2(-vector_y, vector_x)
 
-    assert -math.pi <= angle_in_radians <= math.pi, (
-        f"Expected atan2 result between -pi ({-math.pi=}) and pi ({math.pi=}, "
-        f"but got {angle_in_radians=}"
-    )
+def _compute_geometry(
+    keypoints: npt.NDArray[np.float64],
+) -> Tuple[
+    npt.NDArray[np.float64],
+    npt.NDArray[np.float64],
+    npt.NDArray[np.float64],
+    npt.NDArray[np.float64],
+]:
+    """
+    Compute the geometry of the keypoints packed with :py:func:`pack_keypoints`.
 
-    angle_in_degrees = angle_in_radians * 180.0 / math.pi
+    :return:
+        centers of the wrists, hip levels, relative pointers and wheel angles in
+        degrees, where NaN means that the essential keypoints are missing
+    """
+    nose_y = keypoints[..., 0, 1]
 
-    assert (
-        -180.0 <= angle_in_degrees <= 180.0
-    ), f"Expected angle in degrees between -180 and 180, but got {angle_in_degrees=}"
+    # NOTE (mristin, 2023-08-23):
+    # Both hands are necessary for the center. A missing wrist propagates as NaN.
+    centers = keypoints[..., 1:3, :].mean(axis=-2)
 
-    return angle_in_degrees
+    # NOTE (mristin, 2023-08-23):
+    # A single hip suffices for the hip level.
+    hips_y = keypoints[..., 3:5, 1]
+    hip_counts = np.count_nonzero(~np.isnan(hips_y), axis=-1)
 
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hip_levels = np.nansum(hips_y, axis=-1) / hip_counts
 
-#: In degrees
-ANGLE_TOLERANCE_FOR_NEUTRALITY = 22
+        # NOTE (mristin, 2023-07-26):
+        # The coordinates of the body keypoints live in the top-left corner of the
+        # input frame. The higher pointer in the physical space is *lower* in that
+        # space.
+        relative_pointers = (hip_levels - centers[..., 1]) / (hip_levels - nose_y)
 
+    # NOTE (mristin, 2023-08-16):
+    # We focus only on the right hand as we assume that the wheel is formed by putting
+    # a circle through *both* hands.
 
-def determine_wheel_direction(detection: bodypose.Detection) -> Wheel:
-    """
-    Determine the wheel direction based on the given hand pose of the player.
+    # NOTE (mristin, 2023-08-17):
+    # We flip the input to give better feedback to the user. However, this means
+    # that the detector sees flipped keypoints as well. Therefore, the right hand
+    # corresponds then to the *left* wrist keypoint.
+    #
+    # We have to take ``-vector_y`` since the coordinates originate from
+    # the top-left corner of the screen.
+    vectors = keypoints[..., 1, :] - centers
+    angles_in_degrees = np.degrees(np.arctan2(-vectors[..., 1], vectors[..., 0]))
+
+    return centers, hip_levels, relative_pointers, angles_in_degrees
+
+
+def _classify_geometry(
+    relative_pointers: npt.NDArray[np.float64],
+    angles_in_degrees: npt.NDArray[np.float64],
+) -> Tuple[npt.NDArray[np.int8], npt.NDArray[np.int8]]:
+    """Classify the geometry from :py:func:`_compute_geometry` as integer codes."""
+    with np.errstate(invalid="ignore"):
+        # NOTE (mristin, 2023-08-25):
+        # The classification is branchless. The search gives us the number of
+        # the thresholds that the relative pointer strictly exceeds.
+        pointer_codes = np.where(
+            np.isnan(relative_pointers),
+            0,
+            1 + np.searchsorted(POINTER_THRESHOLDS, relative_pointers, side="left"),
+        ).astype(np.int8)
 
-    If the hands are not detected, we return :py:attr:`Wheel.NOT_DETECTED`.
+        # NOTE (mristin, 2023-08-16):
+        # We ignore the case where the user makes multiple turns of the wheel,
+        # *i.e.*, we do not account for mirroring effect when the user turns the hands
+        # across the x-axis.
+        wheel_codes = np.where(
+            np.isnan(angles_in_degrees),
+            0,
+            2
+            + (angles_in_degrees > ANGLE_TOLERANCE_FOR_NEUTRALITY).astype(np.int8)
+            - (angles_in_degrees < -ANGLE_TOLERANCE_FOR_NEUTRALITY).astype(np.int8),
+        ).astype(np.int8)
+
+    return pointer_codes, wheel_codes
+
+
+def classify_keypoints(
+    keypoints: npt.NDArray[np.float64],
+) -> Tuple[npt.NDArray[np.int8], npt.NDArray[np.int8]]:
     """
-    angle_in_degrees = determine_wheel_angle(detection=detection)
-    if angle_in_degrees is None:
-        return Wheel.NOT_DETECTED
+    Classify the pointer levels and the wheel directions as integer codes.
 
-    # NOTE (mristin, 2023-08-16):
-    # We ignore the case where the user makes multiple turns of the wheel, *i.e.*,
-    # we do not account for mirroring effect when the user turns the hands across
-    # the x-axis.
-    if abs(angle_in_degrees) <= ANGLE_TOLERANCE_FOR_NEUTRALITY:
-        result = Wheel.NEUTRAL
-    elif angle_in_degrees < 0.0:
-        result = Wheel.RIGHT
-    else:
-        result = Wheel.LEFT
+    The leading axes of the ``keypoints`` are arbitrary so that you can classify,
+    *e.g.*, all the frames of a pre-recorded video in a single call. The last
+    two axes are expected as given by :py:func:`pack_keypoints`.
 
-    return result
+    :param keypoints: packed with :py:func:`pack_keypoints`
+    :return:
+        pointer codes and wheel codes, indexing :py:data:`POINTER_BY_CODE` and
+        :py:data:`WHEEL_BY_CODE`, respectively
+    """
+    _, _, relative_pointers, angles_in_degrees = _compute_geometry(keypoints)
+    return _classify_geometry(relative_pointers, angles_in_degrees)
 
 
-def determine_blast(detection: bodypose.Detection) -> Blast:
+def determine_blast(view: DetectionView) -> Blast:
     """
     Try to infer whether the player is blasting or not.
 
     Return :py:attr:`Blast.NOT_DETECTED` if the relevant keypoints are missing.
     """
-    left_wrist = detection.keypoints.get(bodypose.KeypointLabel.LEFT_WRIST, None)
-    right_wrist = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_WRIST, None)
+    left_wrist = view.left_wrist
+    right_wrist = view.right_wrist
 
-    left_shoulder = detection.keypoints.get(bodypose.KeypointLabel.LEFT_SHOULDER, None)
-    right_shoulder = detection.keypoints.get(
-        bodypose.KeypointLabel.RIGHT_SHOULDER, None
-    )
+    left_shoulder = view.left_shoulder
+    right_shoulder = view.right_shoulder
 
     if (
         left_wrist is None
@@ -340,25 +405,117 @@ def determine_blast(detection: bodypose.Detection) -> Blast:
         return Blast.IDLE
 
 
-def _draw_pointer_state(detection: bodypose.Detection, canvas: cv2.Mat) -> None:
+class PlayerFeatures:
     """
-    Draw the pointer state of the player and give feedback.
+    Capture the features of a player computed once per frame.
 
-    The dimensions of the canvas are assumed to correspond to the image.
+    The coordinates live in the coordinate system of the body pose detection:
+    origin in the top-left corner of the image, values generally in [0, 1].
     """
-    height, width, _ = canvas.shape
 
-    nose = detection.keypoints.get(bodypose.KeypointLabel.NOSE, None)
-    left_hip = detection.keypoints.get(bodypose.KeypointLabel.LEFT_HIP, None)
-    right_hip = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_HIP, None)
+    #: Center point between the two hands, if both hands are detected
+    center_of_wrists: Final[Optional[Tuple[float, float]]]
 
-    center = determine_center_of_wrists(detection)
+    #: Average y level of the hips, if any of the hips is detected
+    hip_level: Final[Optional[float]]
 
-    if (
-        nose is not None
-        and (left_hip is not None or right_hip is not None)
-        and center is not None
-    ):
+    #: Angle of the wheel in degrees, if both hands are detected
+    wheel_angle: Final[Optional[float]]
+
+    pointer: Final[Pointer]
+    wheel: Final[Wheel]
+    blast: Final[Blast]
+
+    #: Index of :py:attr:`pointer` in :py:data:`POINTER_BY_CODE`
+    pointer_code: Final[int]
+
+    #: Index of :py:attr:`wheel` in :py:data:`WHEEL_BY_CODE`
+    wheel_code: Final[int]
+
+    @require(lambda pointer_code: 0 <= pointer_code < len(POINTER_BY_CODE))
+    @require(lambda wheel_code: 0 <= wheel_code < len(WHEEL_BY_CODE))
+    def __init__(
+        self,
+        center_of_wrists: Optional[Tuple[float, float]],
+        hip_level: Optional[float],
+        wheel_angle: Optional[float],
+        pointer_code: int,
+        wheel_code: int,
+        blast: Blast,
+    ) -> None:
+        """Initialize with the given values."""
+        self.center_of_wrists = center_of_wrists
+        self.hip_level = hip_level
+        self.wheel_angle = wheel_angle
+        self.pointer_code = pointer_code
+        self.wheel_code = wheel_code
+        self.pointer = POINTER_BY_CODE[pointer_code]
+        self.wheel = WHEEL_BY_CODE[wheel_code]
+        self.blast = blast
+
+
+def compute_player_features(
+    views: Sequence[Optional[DetectionView]],
+) -> List[PlayerFeatures]:
+    """
+    Compute the features of all the players at once.
+
+    If a player has not been detected, the corresponding view is expected as ``None``.
+    """
+    centers, hip_levels, relative_pointers, angles_in_degrees = _compute_geometry(
+        pack_keypoints(views)
+    )
+
+    pointer_codes, wheel_codes = _classify_geometry(
+        relative_pointers, angles_in_degrees
+    )
+
+    result = []  # type: List[PlayerFeatures]
+
+    for i, view in enumerate(views):
+        center_x, center_y = centers[i]
+        hip_level = hip_levels[i]
+        angle = angles_in_degrees[i]
+
+        result.append(
+            PlayerFeatures(
+                center_of_wrists=(
+                    (float(center_x), float(center_y))
+                    if not math.isnan(center_x)
+                    else None
+                ),
+                hip_level=float(hip_level) if not math.isnan(hip_level) else None,
+                wheel_angle=float(angle) if not math.isnan(angle) else None,
+                pointer_code=int(pointer_codes[i]),
+                wheel_code=int(wheel_codes[i]),
+                blast=determine_blast(view) if view is not None else Blast.NOT_DETECTED,
+            )
+        )
+
+    return result
+
+
+def _draw_pointer_state(
+    view: DetectionView,
+    features: PlayerFeatures,
+    canvas: cv2.Mat,
+    height: int,
+    width: int,
+) -> None:
+    """
+    Draw the pointer state of the player and give feedback.
+
+    The dimensions of the canvas, ``height`` and ``width``, are assumed to correspond
+    to the image.
+    """
+    nose = view.nose
+    left_hip = view.left_hip
+    right_hip = view.right_hip
+
+    center = features.center_of_wrists
+    hip_avg_y = features.hip_level
+
+    if nose is not None and hip_avg_y is not None and center is not None:
         bar_x = None  # type: Optional[float]
         if left_hip is not None:
             bar_x = left_hip.x
@@ -368,9 +525,6 @@ def _draw_pointer_state(detection: bodypose.Detection, canvas: cv2.Mat) -> None:
 
         assert bar_x is not None
 
-        hip_avg_y = determine_hip_level(detection)
-        assert hip_avg_y is not None
-
         # NOTE (mristin, 2023-08-17):
         # The coordinate origin is placed in the top-left corner. Thus, points which
         # are physically high are low in this coordinate system.
@@ -384,38 +538,50 @@ def _draw_pointer_state(detection: bodypose.Detection, canvas: cv2.Mat) -> None:
 
         bar_width = 30
 
+        # NOTE (mristin, 2023-08-24):
+        # We convert the relative coordinates to pixels only once, and re-use them
+        # for all the drawn shapes.
+        bar_left = round(bar_x * width)
+        bar_right = bar_left + bar_width
+
+        nose_pixel_y = round(nose.y * height)
+        first_third_pixel_y = round(first_third * height)
+        second_third_pixel_y = round(second_third * height)
+        hip_pixel_y = round(hip_avg_y * height)
+        pointer_pixel_y = round(pointer * height)
+
         # Accelerate
         cv2.rectangle(
             canvas,
-            (round(bar_x * width), round(nose.y * height)),
-            (round(bar_x * width + bar_width), round(first_third * height)),
-            COLOR_BY_POINTER[Pointer.HIGH],
+            (bar_left, nose_pixel_y),
+            (bar_right, first_third_pixel_y),
+            _COLOR_OF_HIGH_POINTER,
             -1,
         )
 
         # Neutral
         cv2.rectangle(
             canvas,
-            (round(bar_x * width), round(first_third * height)),
-            (round(bar_x * width + bar_width), round(second_third * height)),
-            COLOR_BY_POINTER[Pointer.MID],
+            (bar_left, first_third_pixel_y),
+            (bar_right, second_third_pixel_y),
+            _COLOR_OF_MID_POINTER,
             -1,
         )
 
         # Slow down
         cv2.rectangle(
             canvas,
-            (round(bar_x * width), round(second_third * height)),
-            (round(bar_x * width + bar_width), round(hip_avg_y * height)),
-            COLOR_BY_POINTER[Pointer.LOW],
+            (bar_left, second_third_pixel_y),
+            (bar_right, hip_pixel_y),
+            _COLOR_OF_LOW_POINTER,
             -1,
         )
 
         # Outline
         cv2.rectangle(
             canvas,
-            (round(bar_x * width), round(nose.y * height)),
-            (round(bar_x * width + bar_width), round(hip_avg_y * height)),
+            (bar_left, nose_pixel_y),
+            (bar_right, hip_pixel_y),
             (255, 255, 255),
             1,
         )
@@ -423,13 +589,28 @@ def _draw_pointer_state(detection: bodypose.Detection, canvas: cv2.Mat) -> None:
         # Pointer
         cv2.line(
             canvas,
-            (round(bar_x * width), round(pointer * height)),
-            (round(bar_x * width + bar_width), round(pointer * height)),
+            (bar_left, pointer_pixel_y),
+            (bar_right, pointer_pixel_y),
             (255, 255, 255),
             5,
         )
 
 
+@functools.lru_cache(maxsize=128)
+def measure_text(
+    text: str, font_face: int, font_scale: float, thickness: int
+) -> Tuple[Tuple[int, int], int]:
+    """
+    Measure the text with :py:func:`cv2.getTextSize`.
+
+    The drawn texts hardly change from frame to frame, so we cache the measurements.
+    """
+    (text_width, text_height), baseline = cv2.getTextSize(
+        text, font_face, font_scale, thickness
+    )
+    return (text_width, text_height), baseline
+
+
 def put_text_center(
     canvas: cv2.Mat,
     text: str,
@@ -440,7 +621,7 @@ def put_text_center(
     thickness: int,
 ) -> None:
     """Draw the text at the center."""
-    (text_width, text_height), baseline = cv2.getTextSize(
+    (text_width, text_height), baseline = measure_text(
         text, font_face, font_scale, thickness
     )
     cv2.putText(
@@ -465,56 +646,62 @@ COLOR_BY_POINTER = {
     Pointer.NOT_DETECTED: (0, 0, 0),
 }
 
+# NOTE (mristin, 2023-08-28):
+# We look up the colors of the pointer bar only once instead of on every frame.
+_COLOR_OF_HIGH_POINTER = COLOR_BY_POINTER[Pointer.HIGH]
+_COLOR_OF_MID_POINTER = COLOR_BY_POINTER[Pointer.MID]
+_COLOR_OF_LOW_POINTER = COLOR_BY_POINTER[Pointer.LOW]
+
 
 def _draw_wheel_state(
-    detection: bodypose.Detection,
-    pointer: Pointer,
-    blast: Blast,
+    view: DetectionView,
+    features: PlayerFeatures,
     canvas: cv2.Mat,
+    height: int,
+    width: int,
 ) -> None:
     """
     Draw the wheel state of the player and give feedback.
 
-    The dimensions of the canvas are assumed to correspond to the image.
+    The dimensions of the canvas, ``height`` and ``width``, are assumed to correspond
+    to the image.
     """
-    height, width, _ = canvas.shape
+    left_wrist = view.left_wrist
+    right_wrist = view.right_wrist
 
-    assert isinstance(height, int)
-    assert isinstance(width, int)
+    # NOTE (mristin, 2023-08-16):
+    # We multiply by image dimensions since the body keypoints are given in relative
+    # coordinates in the range usually in [0, 1]. Points outside [0, 1] are possible,
+    # *e.g.*, when the model assumes the keypoint, although it is not visible in
+    # the image.
 
-    left_wrist = detection.keypoints.get(bodypose.KeypointLabel.LEFT_WRIST, None)
-    right_wrist = detection.keypoints.get(bodypose.KeypointLabel.RIGHT_WRIST, None)
+    left_wrist_pixel = (
+        (round(left_wrist.x * width), round(left_wrist.y * height))
+        if left_wrist is not None
+        else None
+    )
+
+    right_wrist_pixel = (
+        (round(right_wrist.x * width), round(right_wrist.y * height))
+        if right_wrist is not None
+        else None
+    )
 
     if left_wrist is None or right_wrist is None:
         # NOTE (mristin, 2023-08-16):
         # We draw only the visible keypoints so that the user can see which keypoints
         # are missing.
 
-        if left_wrist is not None:
-            cv2.circle(
-                canvas,
-                (round(left_wrist.x * width), round(left_wrist.y * height)),
-                5,
-                (0, 0, 255),
-                -1,
-            )
+        if left_wrist_pixel is not None:
+            cv2.circle(canvas, left_wrist_pixel, 5, (0, 0, 255), -1)
 
-        if right_wrist is not None:
-            cv2.circle(
-                canvas,
-                (round(right_wrist.x * width), round(right_wrist.y * height)),
-                5,
-                (0, 0, 255),
-                -1,
-            )
+        if right_wrist_pixel is not None:
+            cv2.circle(canvas, right_wrist_pixel, 5, (0, 0, 255), -1)
 
         return
 
-    # NOTE (mristin, 2023-08-16):
-    # We multiply by image dimensions since the body keypoints are given in relative
-    # coordinates in the range usually in [0, 1]. Points outside [0, 1] are possible,
-    # *e.g.*, when the model assumes the keypoint, although it is not visible in
-    # the image.
+    assert left_wrist_pixel is not None
+    assert right_wrist_pixel is not None
 
     xmin = min(left_wrist.x, right_wrist.x) * width
     xmax = max(left_wrist.x, right_wrist.x) * width
@@ -531,19 +718,23 @@ def _draw_wheel_state(
     center_x = xmin + half_width
     center_y = ymin + half_height
 
-    radius = math.sqrt(half_width**2 + half_height**2)
+    radius = math.hypot(half_width, half_height)
 
     thickness = 10
-    if blast is Blast.BLASTING:
+    if features.blast is Blast.BLASTING:
         thickness = 40
 
+    # NOTE (mristin, 2023-08-28):
+    # We draw the circles without anti-aliasing. The anti-aliased thick circles are
+    # expensive to rasterize, while the difference is hardly visible. We keep
+    # the anti-aliasing only for the text.
     cv2.circle(
         canvas,
         (round(center_x), round(center_y)),
         round(radius),
-        COLOR_BY_POINTER[pointer],
+        COLOR_BY_POINTER[features.pointer],
         thickness,
-        cv2.LINE_AA,
+        cv2.LINE_8,
     )
 
     # NOTE (mristin, 2023-08-17):
@@ -552,16 +743,16 @@ def _draw_wheel_state(
     # in order to avoid confusion.
     cv2.circle(
         canvas,
-        (round(left_wrist.x * width), round(left_wrist.y * height)),
+        left_wrist_pixel,
         15,
         (255, 255, 255),
         -1,
-        cv2.LINE_AA,
+        cv2.LINE_8,
     )
     put_text_center(
         canvas,
         "R",
-        (round(left_wrist.x * width), round(left_wrist.y * height)),
+        left_wrist_pixel,
         cv2.FONT_HERSHEY_COMPLEX,
         0.5,
         (0, 0, 0),
@@ -570,16 +761,16 @@ def _draw_wheel_state(
 
     cv2.circle(
         canvas,
-        (round(right_wrist.x * width), round(right_wrist.y * height)),
+        right_wrist_pixel,
         15,
         (255, 255, 255),
         -1,
-        cv2.LINE_AA,
+        cv2.LINE_8,
     )
     put_text_center(
         canvas,
         "L",
-        (round(right_wrist.x * width), round(right_wrist.y * height)),
+        right_wrist_pixel,
         cv2.FONT_HERSHEY_COMPLEX,
         0.5,
         (0, 0, 0),
@@ -590,7 +781,7 @@ def _draw_wheel_state(
     # We leave this code for tuning purposes.
     draw_angle = False
     if draw_angle:
-        angle = determine_wheel_angle(detection=detection)
+        angle = features.wheel_angle
         assert angle is not None
 
         put_text_center(
@@ -605,25 +796,38 @@ def _draw_wheel_state(
 
 
 def draw_player_state(
-    detection: bodypose.Detection,
-    pointer: Pointer,
-    blast: Blast,
+    view: DetectionView,
+    features: PlayerFeatures,
     canvas: cv2.Mat,
+    height: int,
+    width: int,
 ) -> None:
-    """Draw the state of the player to give him/her feedback."""
-    _draw_pointer_state(detection=detection, canvas=canvas)
-    _draw_wheel_state(detection=detection, pointer=pointer, blast=blast, canvas=canvas)
+    """
+    Draw the state of the player to give him/her feedback.
 
+    The dimensions of the canvas, ``height`` and ``width``, are passed in so that
+    we do not have to unpack the shape of the canvas for every drawing.
+    """
+    _draw_pointer_state(
+        view=view, features=features, canvas=canvas, height=height, width=width
+    )
+    _draw_wheel_state(
+        view=view, features=features, canvas=canvas, height=height, width=width
+    )
+
+
+def format_active_keys(active_keys: Set[str]) -> str:
+    """Format the active keys as the text to be shown to the user."""
+    return ", ".join(sorted(active_keys))
 
-def _draw_active_keys(canvas: cv2.Mat, active_keys: Set[str]) -> None:
-    """Draw the list of active keys on the canvas."""
-    text = ", ".join(sorted(active_keys))
 
+def _draw_active_keys(canvas: cv2.Mat, text: str) -> None:
+    """Draw the list of active keys, given as ``text``, on the canvas."""
     font_face = cv2.FONT_HERSHEY_COMPLEX
     font_scale = 0.5
     font_thickness = 1
 
-    (text_width, text_height), _ = cv2.getTextSize(
+    (text_width, text_height), _ = measure_text(
         text, font_face, font_scale, font_thickness
     )
 
@@ -643,19 +847,33 @@ def _draw_active_keys(canvas: cv2.Mat, active_keys: Set[str]) -> None:
     )
 
 
-def _draw_quitting_instructions(canvas: cv2.Mat) -> None:
-    """Draw the instructions how to quit on the canvas."""
-    height, _, _ = canvas.shape
+_QUITTING_INSTRUCTIONS_TEXT = "Press 'q' to quit"
+_QUITTING_INSTRUCTIONS_FONT_FACE = cv2.FONT_HERSHEY_COMPLEX
+_QUITTING_INSTRUCTIONS_FONT_SCALE = 0.5
+_QUITTING_INSTRUCTIONS_FONT_THICKNESS = 1
 
-    text = "Press 'q' to quit"
+(
+    (_QUITTING_INSTRUCTIONS_TEXT_WIDTH, _QUITTING_INSTRUCTIONS_TEXT_HEIGHT),
+    _QUITTING_INSTRUCTIONS_BASELINE,
+) = cv2.getTextSize(
+    _QUITTING_INSTRUCTIONS_TEXT,
+    _QUITTING_INSTRUCTIONS_FONT_FACE,
+    _QUITTING_INSTRUCTIONS_FONT_SCALE,
+    _QUITTING_INSTRUCTIONS_FONT_THICKNESS,
+)
 
-    font_face = cv2.FONT_HERSHEY_COMPLEX
-    font_scale = 0.5
-    font_thickness = 1
 
-    (text_width, text_height), baseline = cv2.getTextSize(
-        text, font_face, font_scale, font_thickness
-    )
+def _draw_quitting_instructions(canvas: cv2.Mat, height: int) -> None:
+    """Draw the instructions how to quit on the canvas of the given ``height``."""
+    text = _QUITTING_INSTRUCTIONS_TEXT
+
+    font_face = _QUITTING_INSTRUCTIONS_FONT_FACE
+    font_scale = _QUITTING_INSTRUCTIONS_FONT_SCALE
+    font_thickness = _QUITTING_INSTRUCTIONS_FONT_THICKNESS
+
+    text_width = _QUITTING_INSTRUCTIONS_TEXT_WIDTH
+    text_height = _QUITTING_INSTRUCTIONS_TEXT_HEIGHT
+    baseline = _QUITTING_INSTRUCTIONS_BASELINE
 
     # We draw the text with the black background assuming that the keys
     # can be represented in a single line.
@@ -680,22 +898,39 @@ def _draw_quitting_instructions(canvas: cv2.Mat) -> None:
 
 
 def draw_instructions(
-    canvas: cv2.Mat, active_keys: Set[str], single_player: bool
+    canvas: cv2.Mat,
+    height: int,
+    width: int,
+    active_keys_text: str,
+    single_player: bool,
 ) -> None:
-    """Draw the screen split and the keys pressed according to the actions."""
-    height, width, _ = canvas.shape
-
+    """
+    Draw the screen split and the keys pressed according to the actions.
+
+    :param canvas: to draw on
+    :param height: of the canvas
+    :param width: of the canvas
+    :param active_keys_text:
+        active keys as formatted by :py:func:`format_active_keys`
+    :param single_player: if set, the screen is not split
+    """
     if not single_player:
         half_width = round(width / 2.0)
         cv2.line(canvas, (half_width, 0), (half_width, height), (255, 255, 255), 2)
 
-    _draw_active_keys(canvas=canvas, active_keys=active_keys)
+    _draw_active_keys(canvas=canvas, text=active_keys_text)
 
-    _draw_quitting_instructions(canvas=canvas)
+    _draw_quitting_instructions(canvas=canvas, height=height)
 
 
 class Keyboard(Protocol):
-    """Define the keyboard interface."""
+    """
+    Define the keyboard interface.
+
+    The engine calls :py:meth:`press` and :py:meth:`release` only when a key changes
+    its state, not on every frame. Hence, the implementations do not need to track
+    the held keys themselves.
+    """
 
     def press(self, key: str) -> None:
         """
@@ -763,11 +998,16 @@ class Engine:
         pointer_to_key_by_player: Sequence[Mapping[Pointer, str]],
         wheel_to_key_by_player: Sequence[Mapping[Wheel, str]],
         blast_key_by_player: Sequence[str],
-        detector: bodypose.Detector,
+        detector: Optional[bodypose.Detector],
         keyboard_control: Keyboard,
         single_player: bool,
     ) -> None:
-        """Initialize with the given values."""
+        """
+        Initialize with the given values.
+
+        If the ``detector`` is not given, the detections need to be supplied
+        externally through :py:meth:`postprocess`.
+        """
         self.pointer_to_key_by_player = pointer_to_key_by_player
         self.wheel_to_key_by_player = wheel_to_key_by_player
         self.blast_key_by_player = blast_key_by_player
@@ -775,30 +1015,120 @@ class Engine:
         self.keyboard = keyboard_control
         self.single_player = single_player
 
-        #: Map key --> activation count. Zero activation means the key should be
-        #: released.
-        self.activations_by_key = collections.defaultdict(
-            lambda: 0
-        )  # type: MutableMapping[str, int]
+        # NOTE (mristin, 2023-08-24):
+        # The universe of the keys is small and known in advance. We intern each key
+        # as an index so that we can track the activations in flat arrays.
+
+        #: Keys indexed by their interned index
+        self._keys = []  # type: List[str]
+
+        index_by_key = dict()  # type: Dict[str, int]
+
+        def intern(key: str) -> int:
+            """Intern the key, and return -1 for an empty key meaning no key."""
+            if key == "":
+                return -1
+
+            index = index_by_key.get(key, None)
+            if index is None:
+                index = len(self._keys)
+                index_by_key[key] = index
+                self._keys.append(key)
+
+            return index
+
+        # NOTE (mristin, 2023-08-29):
+        # We index the interned keys by the pointer and wheel codes instead of
+        # the enumeration literals, so that we avoid hashing the literals on
+        # every frame.
+        self._pointer_index_by_player = [
+            tuple(intern(pointer_to_key[pointer]) for pointer in POINTER_BY_CODE)
+            for pointer_to_key in pointer_to_key_by_player
+        ]  # type: List[Tuple[int, ...]]
+
+        self._wheel_index_by_player = [
+            tuple(intern(wheel_to_key[wheel]) for wheel in WHEEL_BY_CODE)
+            for wheel_to_key in wheel_to_key_by_player
+        ]  # type: List[Tuple[int, ...]]
+
+        self._blast_index_by_player = [
+            intern(key) for key in blast_key_by_player
+        ]  # type: List[int]
+
+        #: Activation count for each interned key. Zero activation means the key should
+        #: be released.
+        #:
+        #: .. note::
+        #:
+        #:     We use 32-bit integers since the activations accumulate if a key is
+        #:     shared between the players.
+        self._activations = np.zeros(len(self._keys), dtype=np.int32)
+
+        #: Mark the interned keys which are currently pressed
+        self._pressed = np.zeros(len(self._keys), dtype=bool)
 
         self.active_keys = set()  # type: Set[str]
 
+        # NOTE (mristin, 2023-08-28):
+        # The active keys rarely change between the frames, so we re-format them
+        # only on a change.
+        self._active_keys_text = format_active_keys(self.active_keys)
+
+        #: Scratch buffer for the frames downscaled in :py:meth:`run`
+        self._downscaled = None  # type: Optional[cv2.Mat]
+
+    @require(lambda self: self.detector is not None)
     def run(self, frame: cv2.Mat) -> cv2.Mat:
         """Execute the engine on one frame."""
+        assert self.detector is not None
+
         frame = cv2.flip(frame, 1)
 
-        detections = self.detector(frame)
+        # NOTE (mristin, 2023-08-26):
+        # We detect on the downscaled frame, but draw on the original one. This works
+        # since the keypoints are given in relative coordinates.
+        #
+        # NOTE (mristin, 2023-08-30):
+        # We call the detector only once per frame, also in the two-player mode.
+        # The multi-pose model detects both players in the whole frame at once, and
+        # we only split the detections afterwards in :py:meth:`control`.
+        #
+        # The detector consumes the downscaled frame before it returns, so we can
+        # re-use the same buffer for all the frames.
+        self._downscaled = bodypose.downscale_for_detection(frame, self._downscaled)
+        detections = self.detector(self._downscaled)
+
+        return self.postprocess(frame=frame, detections=detections)
+
+    def postprocess(
+        self, frame: cv2.Mat, detections: Sequence[bodypose.Detection]
+    ) -> cv2.Mat:
+        """
+        Handle the keyboard and draw the state given the detections on the frame.
+
+        The frame is expected to be already flipped.
+        """
+        return self.draw(frame=frame, state=self.control(detections))
+
+    def control(self, detections: Sequence[bodypose.Detection]) -> "EngineState":
+        """
+        Handle the keyboard given the detections.
 
+        :param detections: detected on the current frame
+        :return: state of the engine to be drawn with :py:meth:`draw`
+        """
         # NOTE (mristin, 2023-08-17):
         # We added the single-player mode after the original development.
         # That is why it feels so clunky here.
+        views = [DetectionView(detection) for detection in detections]
+
         if not self.single_player:
-            player_detections = split_detections_for_each_player(detections)
+            player_views = split_detections_for_each_player(views)
         else:
-            if len(detections) == 0:
-                player_detections = (None, None)
+            if len(views) == 0:
+                player_views = (None, None)
             else:
-                player_detections = (detections[0], None)
+                player_views = (views[0], None)
 
         # NOTE (mristin, 2023-07-27):
         # Decrement each activation by one. Zero means we have to de-activate
@@ -808,81 +1138,172 @@ class Engine:
         # :py:meth:`keyboard.release` is that we might share the keys *between*
         # the players. For example, player 1 high can be the same key as player 2
         # low.
-        for key in self.activations_by_key:
-            self.activations_by_key[key] -= 1
-
-        for player_id, detection in enumerate(player_detections):
-            if detection is None:
-                pointer_position = Pointer.NOT_DETECTED
-                wheel_direction = Wheel.NOT_DETECTED
-                blast = Blast.NOT_DETECTED
-            else:
-                pointer_position = determine_pointer_position(detection)
-                wheel_direction = determine_wheel_direction(detection)
-                blast = determine_blast(detection)
+        self._activations -= 1
+        np.clip(self._activations, 0, None, out=self._activations)
+
+        features_by_player = compute_player_features(player_views)
+
+        for player_id, features in enumerate(features_by_player):
+            blast = features.blast
 
             # region Handle keyboard for the pointer
-            pointer_key = self.pointer_to_key_by_player[player_id][pointer_position]
-            if pointer_key != "":
-                self.activations_by_key[pointer_key] += 1
+            pointer_index = self._pointer_index_by_player[player_id][
+                features.pointer_code
+            ]
+            if pointer_index >= 0:
+                self._activations[pointer_index] += 1
             # endregion
 
             # region Handle keyboard for the wheel
-            wheel_key = self.wheel_to_key_by_player[player_id][wheel_direction]
-            if wheel_key != "":
-                self.activations_by_key[wheel_key] += 1
+            wheel_index = self._wheel_index_by_player[player_id][features.wheel_code]
+            if wheel_index >= 0:
+                self._activations[wheel_index] += 1
             # endregion
 
             # region Handle keyboard for the blast
             if blast is Blast.BLASTING:
-                blast_key = self.blast_key_by_player[player_id]
-                if blast_key != "":
-                    self.activations_by_key[blast_key] += 1
+                blast_index = self._blast_index_by_player[player_id]
+                if blast_index >= 0:
+                    self._activations[blast_index] += 1
             # endregion
 
-            if detection is not None:
-                draw_player_state(
-                    detection=detection,
-                    pointer=pointer_position,
-                    blast=blast,
-                    canvas=frame,
-                )
+        should_be_pressed = self._activations > 0
 
-        released_key_set = set()  # type: Set[str]
-        for key, activation in self.activations_by_key.items():
-            assert activation >= 0
+        # NOTE (mristin, 2023-08-29):
+        # We diff the desired state against the pressed keys, and send only
+        # the transitions to the keyboard. Holding a key over many frames thus costs
+        # a single press and a single release.
+        to_release = np.flatnonzero(self._pressed & ~should_be_pressed)
+        to_press = np.flatnonzero(should_be_pressed & ~self._pressed)
 
-            if activation == 0:
-                assert key in self.active_keys, (
-                    f"Key {key=} to be released, " f"but not in the {self.active_keys=}"
-                )
-                released_key_set.add(key)
-                self.keyboard.release(key)
-                self.active_keys.remove(key)
-            else:
-                if key not in self.active_keys:
-                    self.keyboard.press(key)
-                    self.active_keys.add(key)
+        for index in to_release:
+            key = self._keys[index]
+            self.keyboard.release(key)
+            self.active_keys.remove(key)
+
+        for index in to_press:
+            key = self._keys[index]
+            self.keyboard.press(key)
+            self.active_keys.add(key)
+
+        self._pressed = should_be_pressed
 
-        for key in released_key_set:
-            del self.activations_by_key[key]
+        if len(to_release) > 0 or len(to_press) > 0:
+            self._active_keys_text = format_active_keys(self.active_keys)
+
+        return EngineState(
+            player_views=player_views,
+            features_by_player=features_by_player,
+            active_keys_text=self._active_keys_text,
+        )
+
+    def draw(self, frame: cv2.Mat, state: "EngineState") -> cv2.Mat:
+        """
+        Draw the ``state`` on the ``frame``.
+
+        This method does not change the engine, so it can be run in a separate thread
+        while the engine already handles the next frame.
+        """
+        # NOTE (mristin, 2023-08-28):
+        # We unpack the frame dimensions only once, and pass them on to all
+        # the drawing functions.
+        height, width, _ = frame.shape
+
+        for view, features in zip(state.player_views, state.features_by_player):
+            if view is not None:
+                draw_player_state(
+                    view=view,
+                    features=features,
+                    canvas=frame,
+                    height=height,
+                    width=width,
+                )
 
         draw_instructions(
-            canvas=frame, active_keys=self.active_keys, single_player=self.single_player
+            canvas=frame,
+            height=height,
+            width=width,
+            active_keys_text=state.active_keys_text,
+            single_player=self.single_player,
         )
 
         return frame
 
 
-KEY_BY_NAME = {key.name: key for key in pynput.keyboard.Key}
+class EngineState:
+    """Capture the state of the engine after a frame needed for drawing."""
+
+    #: Detection views assigned to each player
+    player_views: Final[Tuple[Optional[DetectionView], Optional[DetectionView]]]
 
+    #: Features computed for each player
+    features_by_player: Final[Sequence[PlayerFeatures]]
 
-def key_from_string(key: str) -> Union[pynput.keyboard.Key | pynput.keyboard.KeyCode]:
-    """Translate the string into a key."""
-    if len(key) == 1:
-        return pynput.keyboard.KeyCode.from_char(key)
+    #: Active keys as formatted by :py:func:`format_active_keys`
+    active_keys_text: Final[str]
 
-    return KEY_BY_NAME[key]
+    def __init__(
+        self,
+        player_views: Tuple[Optional[DetectionView], Optional[DetectionView]],
+        features_by_player: Sequence[PlayerFeatures],
+        active_keys_text: str,
+    ) -> None:
+        """Initialize with the given values."""
+        self.player_views = player_views
+        self.features_by_player = features_by_player
+        self.active_keys_text = active_keys_text
+
+
+def flip_and_downscale(frame: cv2.Mat, use_opencl: bool) -> Tuple[cv2.Mat, cv2.Mat]:
+    """
+    Flip the frame for the display, and downscale it for the detection.
+
+    :param frame: as captured from the camera
+    :param use_opencl:
+        if set, perform the operations on the OpenCL device through
+        :py:class:`cv2.UMat`
+    :return: flipped frame, and the flipped frame downscaled for the detection
+    """
+    if not use_opencl:
+        flipped = cv2.flip(frame, 1)
+        return flipped, bodypose.downscale_for_detection(flipped)
+
+    # NOTE (mristin, 2023-08-28):
+    # We download the frames from the device right away. The drawing consists of
+    # many small operations which are not worth a round-trip to the device each,
+    # and the detector as well as the display expect the frames in the host memory.
+    height, width, _ = frame.shape
+    new_height, new_width = bodypose.determine_input_size(height, width)
+
+    flipped_umat = cv2.flip(cv2.UMat(frame), 1)
+    downscaled_umat = cv2.resize(
+        flipped_umat, (new_width, new_height), interpolation=cv2.INTER_AREA
+    )
+
+    return flipped_umat.get(), downscaled_umat.get()
+
+
+#: Name of the window showing the feedback to the user
+WINDOW_NAME = "el-volante-virtual"
+
+#: Code of the key, as returned by :py:func:`poll_key`, which quits the application
+QUIT_KEY = ord("q")
+
+
+def poll_key() -> int:
+    """
+    Process the window events, and return the pressed key without waiting.
+
+    If no key has been pressed, return 255.
+    """
+    # NOTE (mristin, 2023-08-29):
+    # The function :py:func:`cv2.waitKey` sleeps for at least a millisecond, which
+    # would throttle the loop. :py:func:`cv2.pollKey` is only available in newer
+    # versions of OpenCV, so we fall back to the shortest wait otherwise.
+    if hasattr(cv2, "pollKey"):
+        return int(cv2.pollKey()) & 0xFF
+
+    return int(cv2.waitKey(1)) & 0xFF
 
 
 def validate_keys(args: argparse.Namespace) -> Optional[List[str]]:
@@ -920,13 +1341,17 @@ def validate_keys(args: argparse.Namespace) -> Optional[List[str]]:
     return None
 
 
-def main(prog: str) -> int:
+def main(prog: str, argv: Optional[Sequence[str]] = None) -> int:
     """
     Execute the main routine.
 
     :param prog: name of the program to be displayed in the help
+    :param argv: command-line arguments; if not given, taken from :py:data:`sys.argv`
     :return: exit code
     """
+    if argv is None:
+        argv = sys.argv[1:]
+
     parser = argparse.ArgumentParser(
         prog=prog,
         description=__doc__,
@@ -1021,17 +1446,60 @@ def main(prog: str) -> int:
         help="If set, handles only a single player instead of the two players",
         action="store_true",
     )
+    parser.add_argument(
+        "--model_precision",
+        help=(
+            "Numerical precision of the body pose model. Reduced precision makes "
+            "the detection faster, but less accurate"
+        ),
+        choices=[literal.value for literal in bodypose.Precision],
+        default=bodypose.Precision.FP32.value,
+    )
+    parser.add_argument(
+        "--use_opencl",
+        help=(
+            "If set, flip and downscale the frames with OpenCL, if available, "
+            "for example, on an integrated GPU"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--use_gstreamer",
+        help=(
+            "If set, read the camera through a GStreamer pipeline. "
+            "This works only on Linux, and OpenCV needs to be built with GStreamer"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pin_threads",
+        help=(
+            "If set, pin the detector to all the cores but the last one, and "
+            "the capture and the display to the last core. This works only on Linux"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--skip_static_frames",
+        help=(
+            "If set, re-use the previous detections on the frames where no part of "
+            "the image changed noticeably. This saves the detection when you stand "
+            "still, but the very small movements might be noticed with a delay"
+        ),
+        action="store_true",
+    )
 
     # NOTE (mristin, 2023-07-26):
     # The module ``argparse`` is not flexible enough to understand special options such
     # as ``--version`` so we manually hard-wire.
-    if "--version" in sys.argv and "--help" not in sys.argv:
+    if "--version" in argv and "--help" not in argv:
         print(elvolantevirtual.__version__)
         return 0
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     camera_index = int(args.camera_index)
+    use_gstreamer = bool(args.use_gstreamer)
 
     invalid_key_args = validate_keys(args)
     if invalid_key_args is not None:
@@ -1079,73 +1547,205 @@ def main(prog: str) -> int:
 
     single_player = bool(args.single_player)
 
+    use_opencl = bool(args.use_opencl) and cv2.ocl.haveOpenCL()
+    if args.use_opencl and not use_opencl:
+        print(
+            "OpenCL is not available, the frames will be processed on the CPU.",
+            file=sys.stderr,
+        )
+
+    model_precision = bodypose.Precision(args.model_precision)
+
+    detector_cores = None  # type: Optional[Set[int]]
+    application_cores = None  # type: Optional[Set[int]]
+
+    if args.pin_threads:
+        if not hasattr(os, "sched_setaffinity"):
+            print(
+                "Pinning the threads is not supported on this platform.",
+                file=sys.stderr,
+            )
+            return 1
+
+        available_cores = sorted(os.sched_getaffinity(0))
+        if len(available_cores) < 2:
+            print(
+                "Pinning the threads requires at least two cores, "
+                f"but only {len(available_cores)} is available.",
+                file=sys.stderr,
+            )
+            return 1
+
+        detector_cores = set(available_cores[:-1])
+        application_cores = {available_cores[-1]}
+
     print("Loading the detector...")
 
     # noinspection SpellCheckingInspection
-    detector = bodypose.load_detector(
-        PACKAGE_DIR / "media" / "models" / "312f001449331ee3d410d758fccdc9945a65dbc3"
+    detector_process = bodypose.DetectorProcess(
+        PACKAGE_DIR / "media" / "models" / "312f001449331ee3d410d758fccdc9945a65dbc3",
+        model_precision,
+        detector_cores,
+        bool(args.skip_static_frames),
     )
 
+    if application_cores is not None:
+        # NOTE (mristin, 2023-08-30):
+        # We pin the main thread before starting the other threads so that
+        # the capture and the drawing threads inherit the affinity. The OpenCV
+        # operations in this process run on a single core then as well.
+        os.sched_setaffinity(0, application_cores)
+        cv2.setNumThreads(1)
+
+    # NOTE (mristin, 2023-08-29):
+    # We open the camera only once the detector is warmed up. Otherwise, the first
+    # frames would wait for seconds on the first inference.
+    try:
+        detector_process.wait_until_ready()
+    except RuntimeError as exception:
+        print(f"Failed to load the detector: {exception}", file=sys.stderr)
+        detector_process.close()
+        return 1
+
     print("Opening the video capture...")
     try:
-        cap = cv2.VideoCapture(camera_index)
+        grabber = capture.FrameGrabber(camera_index, use_gstreamer)
 
     except Exception as exception:
         print(
             f"Failed to open the video capture at index {camera_index}: {exception}",
             file=sys.stderr,
         )
+        detector_process.close()
         return 1
 
+    drawing_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
     try:
-        cv2.namedWindow("el-volante-virtual", cv2.WINDOW_NORMAL)
-        cv2.resizeWindow("el-volante-virtual", 640, 800)
-        cv2.moveWindow("el-volante-virtual", 0, 0)
+        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(WINDOW_NAME, 640, 800)
+        cv2.moveWindow(WINDOW_NAME, 0, 0)
 
         class KeyboardControl(Keyboard):
             """Implement a keyboard control with :py:mod:`pyinput`."""
 
-            def __init__(self) -> None:
+            def __init__(self, keys: Iterable[str]) -> None:
                 self.controller = pynput.keyboard.Controller()
 
+                # NOTE (mristin, 2023-08-28):
+                # We translate all the configured keys only once so that pressing
+                # and releasing is a simple look-up.
+                self._resolved_keys = {
+                    key: key_from_string(key) for key in keys if key != ""
+                }  # type: Mapping[str, Union[pynput.keyboard.Key, pynput.keyboard.KeyCode]]
+
             def press(self, key: str) -> None:
-                self.controller.press(key_from_string(key))
+                self.controller.press(self._resolved_keys[key])
 
             def release(self, key: str) -> None:
-                self.controller.release(key_from_string(key))
+                self.controller.release(self._resolved_keys[key])
 
         engine = Engine(
             pointer_to_key_by_player=pointer_to_key_by_player,
             wheel_to_key_by_player=wheel_to_key_by_player,
             blast_key_by_player=blast_key_by_player,
-            detector=detector,
-            keyboard_control=KeyboardControl(),
+            detector=None,
+            keyboard_control=KeyboardControl(
+                itertools.chain(
+                    (
+                        key
+                        for pointer_to_key in pointer_to_key_by_player
+                        for key in pointer_to_key.values()
+                    ),
+                    (
+                        key
+                        for wheel_to_key in wheel_to_key_by_player
+                        for key in wheel_to_key.values()
+                    ),
+                    blast_key_by_player,
+                )
+            ),
             single_player=single_player,
         )
 
-        while True:
-            reading_ok, frame = cap.read()
+        # NOTE (mristin, 2023-08-26):
+        # We keep the full-resolution frames for drawing, while the detector process
+        # receives only the downscaled ones. Frames dropped by the detector process
+        # are dropped here as well.
+        pending_frames = dict()  # type: Dict[int, cv2.Mat]
+        next_frame_id = 0
+
+        def read_and_submit() -> bool:
+            """Read the next frame and submit it to the detection."""
+            nonlocal next_frame_id
+
+            reading_ok, frame = grabber.read()
             if not reading_ok:
                 print("Failed to read a frame from the video capture.", file=sys.stderr)
+                return False
+
+            frame, downscaled = flip_and_downscale(frame, use_opencl)
+
+            pending_frames[next_frame_id] = frame
+            detector_process.submit(next_frame_id, downscaled)
+            next_frame_id += 1
+
+            return True
+
+        # NOTE (mristin, 2023-08-22):
+        # We always submit the next frame to the detector *before* we post-process
+        # the current one so that the detection and the drawing overlap.
+        if not read_and_submit():
+            return 1
+
+        # NOTE (mristin, 2023-08-28):
+        # We draw in a background thread so that the drawing of the current frame
+        # overlaps with the keyboard handling of the next one. The window is shown
+        # in the main thread, since some GUI back-ends do not work from other
+        # threads. We show the drawn frame with the delay of one iteration.
+        drawing = None  # type: Optional[concurrent.futures.Future[cv2.Mat]]
+
+        while True:
+            frame_id, detections = detector_process.fetch()
+
+            frame = pending_frames.pop(frame_id)
+            for stale_frame_id in [
+                pending_id for pending_id in pending_frames if pending_id < frame_id
+            ]:
+                del pending_frames[stale_frame_id]
+
+            if not read_and_submit():
                 break
 
-            frame = engine.run(frame)
+            state = engine.control(detections)
+
+            next_drawing = drawing_executor.submit(engine.draw, frame, state)
+
+            if drawing is not None:
+                cv2.imshow(WINDOW_NAME, drawing.result())
 
-            cv2.imshow("el-volante-virtual", frame)
-            key = cv2.waitKey(10) & 0xFF
+            drawing = next_drawing
 
-            if key == ord("q"):
+            key = poll_key()
+
+            if key == QUIT_KEY:
                 print("Received 'q', quitting...")
                 break
             else:
                 pass
 
     finally:
-        if cap is not None:
+        drawing_executor.shutdown(wait=True)
+
+        if grabber is not None:
             print("Closing the video capture...")
-            cap.release()
+            grabber.release()
             print("Video capture closed.")
 
+        print("Stopping the detector...")
+        detector_process.close()
+        print("Detector stopped.")
+
     print("Goodbye.")
 
     return 0
@@ -1157,4 +1757,9 @@ def entry_point() -> int:
 
 
 if __name__ == "__main__":
+    # NOTE (mristin, 2023-08-22):
+    # We need to support the frozen executables since we run the detector in
+    # a separate process.
+    multiprocessing.freeze_support()
+
     sys.exit(main(prog="el-volante-virtual"))
@@ -1,7 +1,10 @@
 """Simulate the gamepad on a pre-recorded video."""
 import argparse
 import pathlib
+import queue
 import sys
+import threading
+from typing import Any, Optional
 
 import cv2
 
@@ -10,6 +13,39 @@ import elvolantevirtual.main
 import elvolantevirtual.bodypose
 
 
+def _put_until_stopped(
+    target: "queue.Queue[Any]", item: Any, stop: threading.Event
+) -> bool:
+    """
+    Put the item in the queue, waiting while the queue is full.
+
+    :return: False if stopped before the item could be put
+    """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def _get_until_stopped(source: "queue.Queue[Any]", stop: threading.Event) -> Any:
+    """
+    Get the next item from the queue, waiting while the queue is empty.
+
+    :return: None if stopped before an item could be retrieved
+    """
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    return None
+
+
 def main(prog: str) -> int:
     """Execute the main routine."""
     parser = argparse.ArgumentParser(prog=prog, description=__doc__)
@@ -22,6 +58,15 @@ def main(prog: str) -> int:
         help="If set, handles only a single player instead of the two players",
         action="store_true",
     )
+    parser.add_argument(
+        "--model_precision",
+        help=(
+            "Numerical precision of the body pose model. Reduced precision makes "
+            "the detection faster, but less accurate"
+        ),
+        choices=[literal.value for literal in elvolantevirtual.bodypose.Precision],
+        default=elvolantevirtual.bodypose.Precision.FP32.value,
+    )
 
     # NOTE (mristin, 2023-07-26):
     # The module ``argparse`` is not flexible enough to understand special options such
@@ -34,6 +79,7 @@ def main(prog: str) -> int:
 
     source_pth = pathlib.Path(args.source)
     single_player = bool(args.single_player)
+    model_precision = elvolantevirtual.bodypose.Precision(args.model_precision)
 
     if not source_pth.exists():
         print(f"--source does not exist: {source_pth}", file=sys.stderr)
@@ -82,9 +128,13 @@ def main(prog: str) -> int:
         elvolantevirtual.main.PACKAGE_DIR
         / "media"
         / "models"
-        / "312f001449331ee3d410d758fccdc9945a65dbc3"
+        / "312f001449331ee3d410d758fccdc9945a65dbc3",
+        model_precision,
     )
 
+    print("Warming up the detector...")
+    elvolantevirtual.bodypose.warm_up(detector)
+
     print("Opening the video file...")
     try:
         cap = cv2.VideoCapture(str(source_pth))
@@ -119,22 +169,71 @@ def main(prog: str) -> int:
             single_player=single_player,
         )
 
-        while cap.isOpened():
-            reading_ok, frame = cap.read()
-            if not reading_ok:
-                print(f"Could not read any more frames from --source: {source_pth}")
-                break
-
-            frame = engine.run(frame)
-
-            cv2.imshow(window_name, frame)
-            key = cv2.waitKey(25) & 0xFF
-
-            if key == ord("q"):
-                print("Received 'q', quitting...")
-                break
-            else:
-                pass
+        # NOTE (mristin, 2023-08-29):
+        # We decode, detect and display in separate stages so that the stages
+        # overlap. The queues are bounded and the stages wait on each other instead
+        # of dropping frames, since we want to simulate on every frame of the video.
+        # The value ``None`` in a queue signals the end of the video.
+        stop = threading.Event()
+
+        read_queue = queue.Queue(maxsize=2)  # type: queue.Queue[Optional[cv2.Mat]]
+        show_queue = queue.Queue(maxsize=2)  # type: queue.Queue[Optional[cv2.Mat]]
+
+        def read_frames() -> None:
+            """Decode the frames from the video."""
+            try:
+                while cap.isOpened():
+                    reading_ok, frame = cap.read()
+                    if not reading_ok:
+                        print(
+                            f"Could not read any more frames from --source: "
+                            f"{source_pth}"
+                        )
+                        break
+
+                    if not _put_until_stopped(read_queue, frame, stop):
+                        break
+            finally:
+                _put_until_stopped(read_queue, None, stop)
+
+        def detect_in_frames() -> None:
+            """Run the engine on the decoded frames."""
+            try:
+                while True:
+                    frame = _get_until_stopped(read_queue, stop)
+                    if frame is None:
+                        break
+
+                    if not _put_until_stopped(show_queue, engine.run(frame), stop):
+                        break
+            finally:
+                _put_until_stopped(show_queue, None, stop)
+
+        threads = [
+            threading.Thread(target=read_frames, daemon=True),
+            threading.Thread(target=detect_in_frames, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                frame = _get_until_stopped(show_queue, stop)
+                if frame is None:
+                    break
+
+                cv2.imshow(window_name, frame)
+                key = elvolantevirtual.main.poll_key()
+
+                if key == elvolantevirtual.main.QUIT_KEY:
+                    print("Received 'q', quitting...")
+                    break
+                else:
+                    pass
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
 
     finally:
         if cap is not None:
@@ -1,17 +1,8 @@
 import time
-from typing import Optional, Union
 
 import pynput.keyboard
 
-KEY_BY_NAME = {key.name: key for key in pynput.keyboard.Key}
-
-
-def key_from_string(key: str) -> Union[pynput.keyboard.Key | pynput.keyboard.KeyCode]:
-    """Translate the string into a key."""
-    if len(key) == 1:
-        return pynput.keyboard.KeyCode.from_char(key)
-
-    return KEY_BY_NAME[key]
+from elvolantevirtual.keys import key_from_string
 
 
 def main() -> None:
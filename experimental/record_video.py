@@ -1,11 +1,15 @@
 """Record video from a webcam to a file."""
 import argparse
 import pathlib
+import queue
 import sys
-from typing import Optional
+import threading
+from typing import List, Optional
 
 import cv2
 
+import elvolantevirtual.capture
+
 
 def main(prog: str) -> int:
     """
@@ -42,7 +46,11 @@ def main(prog: str) -> int:
 
     print("Opening the video capture...")
     try:
-        cap = cv2.VideoCapture(camera_index)
+        # NOTE (mristin, 2023-08-29):
+        # We record in the same mode as the application captures the frames.
+        cap = elvolantevirtual.capture.open_video_capture(
+            camera_index, use_gstreamer=False
+        )
 
     except Exception as exception:
         print(
@@ -53,12 +61,42 @@ def main(prog: str) -> int:
 
     out = None  # type: Optional[cv2.VideoWriter]
 
+    # NOTE (mristin, 2023-08-29):
+    # We encode the video in a separate thread so that the encoding does not hold
+    # back the capture. The value ``None`` signals the end of the recording.
+    #
+    # NOTE (mristin, 2023-08-30):
+    # We capture into a small pool of frames which we recycle once they are
+    # encoded, instead of allocating a new frame on every read. The queues pass
+    # around the indices of the frames in the pool. The frames are allocated
+    # lazily on the first read, as we do not know their size in advance.
+    frame_pool = [None] * 8  # type: List[Optional[cv2.Mat]]
+
+    free_queue = queue.Queue()  # type: queue.Queue[int]
+    for index in range(len(frame_pool)):
+        free_queue.put(index)
+
+    write_queue = queue.Queue()  # type: queue.Queue[Optional[int]]
+    writer_thread = None  # type: Optional[threading.Thread]
+
+    def write_frames(writer: cv2.VideoWriter) -> None:
+        """Encode the queued frames until the end of the recording."""
+        while True:
+            index = write_queue.get()
+            if index is None:
+                break
+
+            writer.write(frame_pool[index])
+            free_queue.put(index)
+
     try:
         window_name = "el-volante-virtual-record-video"
         cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
 
         while True:
-            reading_ok, frame = cap.read()
+            index = free_queue.get()
+
+            reading_ok, frame = cap.read(frame_pool[index])
             if not reading_ok:
                 print("Failed to read a frame from the video capture.", file=sys.stderr)
                 return 1
@@ -80,7 +118,13 @@ def main(prog: str) -> int:
 
                 out = cv2.VideoWriter(str(target_pth), fourcc, 25.0, (width, height))
 
-            out.write(frame)
+                writer_thread = threading.Thread(
+                    target=write_frames, args=(out,), daemon=True
+                )
+                writer_thread.start()
+
+            frame_pool[index] = frame
+            write_queue.put(index)
 
             key = cv2.waitKey(10) & 0xFF
 
@@ -96,6 +140,11 @@ def main(prog: str) -> int:
             cap.release()
             print("Video capture closed.")
 
+        if writer_thread is not None:
+            print("Waiting for the video encoding to finish...")
+            write_queue.put(None)
+            writer_thread.join()
+
         if out is not None:
             print("Closing the video writer...")
             out.release()
@@ -3,21 +3,28 @@ Run with the keys set for Micro Machines dosbox.
 
 The emulated Micro Machines do not accept key arrows for keys, so we map to letters.
 """
+import multiprocessing
 import os.path
 import pathlib
 import sys
-import subprocess
 
+# NOTE (mristin, 2023-08-30):
+# We run the checked-out version of the application, the same as if the script
+# ``elvolantevirtual/main.py`` were run directly.
+sys.path.insert(0, str(pathlib.Path(os.path.realpath(__file__)).parent.parent))
+
+import elvolantevirtual.main  # pylint: disable=wrong-import-position
 
-def main() -> None:
-    """Execute the main routine."""
-    this_path = pathlib.Path(os.path.realpath(__file__))
-    repo_root = this_path.parent.parent
 
-    subprocess.call(
-        [
-            sys.executable,
-            str(repo_root / "elvolantevirtual/main.py"),
+def main() -> int:
+    """Execute the main routine."""
+    # NOTE (mristin, 2023-08-30):
+    # We run the application in the same process instead of starting a new
+    # interpreter, so that we do not have to import everything twice.
+    # fmt: off
+    return elvolantevirtual.main.main(
+        prog="el-volante-virtual",
+        argv=[
             "--key_for_player1_high", "w",
             "--key_for_player1_mid", "",
             "--key_for_player1_low", "s",
@@ -30,9 +37,15 @@ def main() -> None:
             "--key_for_player2_left", "h",
             "--key_for_player2_neutral", "",
             "--key_for_player2_right", "k",
-        ]
+        ],
     )
+    # fmt: on
 
 
 if __name__ == "__main__":
-    main()
+    # NOTE (mristin, 2023-08-30):
+    # The application runs the detector in a separate process, so we need to support
+    # the frozen executables as well.
+    multiprocessing.freeze_support()
+
+    sys.exit(main())